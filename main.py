@@ -5,13 +5,23 @@ ta2music - TubeArchivist to Music
 
 import os
 import sys
+import queue
 import logging
-import hashlib
 import subprocess
 import sqlite3
-import re
+import signal
+import threading
+import time
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
 from pathlib import Path
+from typing import Iterator, TypeVar
+from watchdog.observers import Observer
 from watchdog.observers.polling import PollingObserver
 from watchdog.events import FileSystemEventHandler, FileSystemEvent
 
@@ -25,11 +35,24 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+T = TypeVar('T')
+
+# 処理対象とする動画ファイルの拡張子
+_VIDEO_EXTS = frozenset({'.mp4', '.mkv', '.webm', '.avi', '.mov', '.flv', '.m4v'})
+
+# ファイル名に使用できない文字（制御文字と <>:"/\|?*）を '_' に置き換える変換テーブル
+_SANITIZE_TABLE = {c: ord('_') for c in range(0x20)}
+_SANITIZE_TABLE.update({ord(c): ord('_') for c in '<>:"/\\|?*'})
+
 
 class TubeArchivistAPI:
     """TubeArchivist APIクライアント"""
 
-    def __init__(self, base_url: str, token: str):
+    # MUSICプレイリストに含まれないと判定した動画を覚えておく時間（秒）と最大件数
+    NOT_MUSIC_CACHE_TTL = 600
+    NOT_MUSIC_CACHE_MAX_SIZE = 10000
+
+    def __init__(self, base_url: str, token: str, cache_ttl: float | None = None, refresh_interval: float = 300):
         self.base_url = base_url.rstrip('/')
         self.token = token
         self.session = requests.Session()
@@ -37,6 +60,43 @@ class TubeArchivistAPI:
             'Content-Type': 'application/json',
             'Authorization': f'Token {token}'
         })
+        # コネクションプールを広げ、GETが一時的なエラー（429/5xx）になった場合は指数バックオフで再試行する
+        retry = Retry(
+            total=5,
+            backoff_factor=0.5,
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET'])
+        )
+        adapter = HTTPAdapter(
+            pool_connections=20, pool_maxsize=50, max_retries=retry)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # プレイリスト関連のAPIレスポンスをTTL付きでキャッシュ（動画ごとのAPI呼び出しを削減）
+        # 省略時は更新間隔の2倍にして、バックグラウンド更新が1回失敗しても期限切れにならないようにする
+        self.cache_ttl = cache_ttl if cache_ttl is not None else refresh_interval * 2
+        self._playlist_cache: tuple[float, list[dict]] | None = None
+        self._playlist_videos_cache: dict[str, tuple[float, dict[str, str | None]]] = {}
+        self._music_video_ids_cache: tuple[float, frozenset[str]] | None = None
+        # MUSICプレイリストのエントリから得た動画タイトル（動画ID → タイトル）
+        self._music_video_titles: dict[str, str] = {}
+        # MUSICプレイリストに含まれないと判定した動画（動画ID → 有効期限）。古いものから削除するLRU
+        self._not_music_cache: OrderedDict[str, float] = OrderedDict()
+        self._not_music_lock = threading.Lock()
+        # バックグラウンドでのMUSICプレイリスト更新を止めるためのイベント
+        self._refresh_stop = threading.Event()
+        self.refresh_interval = refresh_interval
+
+    def _ttl_get(self, cached: tuple[float, T] | None, fetch: Callable[[], T],
+                 force: bool = False) -> tuple[float, T]:
+        """
+        キャッシュエントリ (有効期限, 値) が有効期限内ならそのまま返し、期限切れなら fetch() で再取得する
+        force=True の場合は有効期限に関係なく再取得する
+        fetch() が例外を送出した場合は新しいエントリを作らない（失敗結果はキャッシュしない）
+        """
+        now = time.monotonic()
+        if not force and cached and cached[0] > now:
+            return cached
+        return (now + self.cache_ttl, fetch())
 
     def get_ta_video_info(self, ta_video_id: str) -> dict | None:
         """
@@ -52,71 +112,148 @@ class TubeArchivistAPI:
             logger.error(f"動画情報の取得に失敗 (video_id: {ta_video_id}): {e}")
             return None
 
-    def get_ta_playlists(self) -> list[dict]:
+    def _get_cached_playlists(self, force: bool = False) -> list[dict]:
         """
-        TubeArchivistからプレイリスト一覧を取得
+        TubeArchivistからプレイリスト一覧を取得（cache_ttl秒キャッシュ）
         /api/playlist/
+        取得に失敗した場合は例外を送出する（空の一覧をキャッシュしないため）
         """
-        try:
-            url = f"{self.base_url}/api/playlist/"
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            return data.get('data', [])
-        except requests.exceptions.RequestException as e:
-            logger.error(f"プレイリスト一覧の取得に失敗: {e}")
-            return []
-
-    def get_ta_playlist_videos(self, ta_playlist_id: str) -> list[str]:
+        entry = self._ttl_get(
+            self._playlist_cache, self._fetch_ta_playlists, force)
+        self._playlist_cache = entry
+        return entry[1]
+
+    def _fetch_ta_playlists(self) -> list[dict]:
+        url = f"{self.base_url}/api/playlist/"
+        response = self.session.get(url, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        return data.get('data', [])
+
+    def _get_cached_playlist_videos(self, ta_playlist_id: str, force: bool = False) -> dict[str, str | None]:
         """
-        TubeArchivistから指定したプレイリストに含まれる動画IDのリストを取得
+        TubeArchivistから指定したプレイリストに含まれる動画を 動画ID → タイトル の辞書で取得（cache_ttl秒キャッシュ）
         /api/playlist/{ta_playlist_id}/
+        取得に失敗した場合は例外を送出する（空の辞書をキャッシュしないため）
         """
-        try:
-            url = f"{self.base_url}/api/playlist/{ta_playlist_id}/"
-            response = self.session.get(url, timeout=10)
-            response.raise_for_status()
-            data = response.json()
-            video_ids: list[str] = []
-            entries = data.get("playlist_entries", [])
-            for entry in entries:
-                if isinstance(entry, dict) and "youtube_id" in entry:
-                    video_ids.append(entry["youtube_id"])
-            return video_ids
-        except requests.exceptions.RequestException as e:
-            logger.error(
-                f"プレイリスト動画の取得に失敗 (playlist_id: {ta_playlist_id}): {e}")
-            return []
+        entry = self._ttl_get(
+            self._playlist_videos_cache.get(ta_playlist_id),
+            lambda: self._fetch_ta_playlist_videos(ta_playlist_id), force)
+        self._playlist_videos_cache[ta_playlist_id] = entry
+        return entry[1]
+
+    def _fetch_ta_playlist_videos(self, ta_playlist_id: str) -> dict[str, str | None]:
+        url = f"{self.base_url}/api/playlist/{ta_playlist_id}/"
+        response = self.session.get(url, timeout=10)
+        response.raise_for_status()
+        data = response.json()
+        videos: dict[str, str | None] = {}
+        entries = data.get("playlist_entries", [])
+        for entry in entries:
+            if isinstance(entry, dict) and "youtube_id" in entry:
+                videos[entry["youtube_id"]] = entry.get(
+                    "title") or entry.get("video_title")
+        return videos
+
+    def get_music_video_ids(self, force: bool = False) -> frozenset[str]:
+        """
+        「MUSIC」で始まるプレイリスト（例: MUSIC2025, MUSIC_ROCK）に含まれる全動画IDの集合を取得（cache_ttl秒キャッシュ）
+        force=True の場合はキャッシュを使わずに取得し直す
+        """
+        entry = self._ttl_get(
+            self._music_video_ids_cache, lambda: self._fetch_music_video_ids(force), force)
+        self._music_video_ids_cache = entry
+        return entry[1]
+
+    def _fetch_music_video_ids(self, force: bool = False) -> frozenset[str]:
+        # 取得に失敗した場合は例外をそのまま送出し、不完全な集合をキャッシュしない
+        video_titles: dict[str, str] = {}
+        video_ids: set[str] = set()
+        for playlist in self._get_cached_playlists(force):
+            # プレイリスト名が「MUSIC」で始まるもののみ対象（例: MUSIC2025, MUSIC_ROCK）
+            if playlist.get('playlist_name', '').upper().startswith('MUSIC'):
+                playlist_id = playlist.get('playlist_id')
+                if playlist_id:
+                    videos = self._get_cached_playlist_videos(
+                        playlist_id, force)
+                    video_ids.update(videos)
+                    video_titles.update(
+                        (video_id, title) for video_id, title in videos.items() if title)
+        self._music_video_titles = video_titles
+        # MUSICプレイリストに追加された動画は否定キャッシュから外す
+        with self._not_music_lock:
+            for video_id in [v for v in self._not_music_cache if v in video_ids]:
+                del self._not_music_cache[video_id]
+        return frozenset(video_ids)
+
+    def start_refresh(self, interval: float | None = None):
+        """
+        MUSICプレイリストの動画ID集合をバックグラウンドで取得し、以降interval秒ごと（省略時はrefresh_interval）に更新する
+        cache_ttlをこの間隔より長くしておくと、キャッシュは期限切れにならずバックグラウンド更新だけで最新に保たれる
+        """
+        if interval is None:
+            interval = self.refresh_interval
+        self._refresh_stop.clear()
+        threading.Thread(target=self._refresh_loop, args=(interval,),
+                         daemon=True, name='music-playlist-refresh').start()
+
+    def stop_refresh(self):
+        """バックグラウンドでの更新を停止する"""
+        self._refresh_stop.set()
+
+    def _refresh_loop(self, interval: float):
+        while True:
+            try:
+                self.get_music_video_ids(force=True)
+            except Exception as e:
+                logger.warning(f"MUSICプレイリストの更新に失敗: {e}")
+            if self._refresh_stop.wait(interval):
+                return
+
+    def get_music_video_title(self, video_id: str) -> str | None:
+        """
+        MUSICプレイリストのエントリに含まれていた動画タイトルを返す（API呼び出しなし）
+        get_music_video_ids() 取得時に一緒にキャッシュされる
+        """
+        return self._music_video_titles.get(video_id)
 
     def is_in_music_playlist(self, video_id: str) -> bool:
         """
         動画が「MUSIC」で始まるプレイリストに含まれているかチェック（例: MUSIC2025, MUSIC_ROCK）
         MP3データのダウンロード前にチェックで使用
         """
+        with self._not_music_lock:
+            expires_at = self._not_music_cache.get(video_id)
+            if expires_at is not None:
+                if expires_at > time.monotonic():
+                    return False
+                del self._not_music_cache[video_id]
+
         try:
-            ta_playlists = self.get_ta_playlists()
-            for playlist in ta_playlists:
-                playlist_name = playlist.get('playlist_name', '')
-                # プレイリスト名が「MUSIC」で始まるもののみ対象（例: MUSIC2025, MUSIC_ROCK）
-                if playlist_name.upper().startswith('MUSIC'):
-                    playlist_id = playlist.get('playlist_id')
-                    if playlist_id:
-                        ta_music_playlist_video_ids = self.get_ta_playlist_videos(
-                            playlist_id)
-                        if video_id in ta_music_playlist_video_ids:
-                            logger.info(
-                                f"動画 {video_id} は「{playlist_name}」プレイリストに含まれています")
-                            return True
+            if video_id in self.get_music_video_ids():
+                logger.info(f"動画 {video_id} はMUSICプレイリストに含まれています")
+                return True
+            self._remember_not_music(video_id)
             return False
         except Exception as e:
             logger.error(f"MUSICプレイリストの確認に失敗 (video_id: {video_id}): {e}")
             return False
 
+    def _remember_not_music(self, video_id: str):
+        """MUSICプレイリストに含まれない動画をNOT_MUSIC_CACHE_TTL秒間キャッシュする"""
+        with self._not_music_lock:
+            self._not_music_cache[video_id] = time.monotonic() + \
+                self.NOT_MUSIC_CACHE_TTL
+            self._not_music_cache.move_to_end(video_id)
+            while len(self._not_music_cache) > self.NOT_MUSIC_CACHE_MAX_SIZE:
+                self._not_music_cache.popitem(last=False)
+
 
 class MusicDownloader:
     """TubeArchivistでダウンロードされた動画を検知し、同じ動画をyt-dlpでMP3形式でダウンロードしてNavidromeで使用可能にするクラス"""
 
-    def __init__(self, ta_dir: str, navidrome_dir: str, db_file: str, ta_api: TubeArchivistAPI | None = None):
+    def __init__(self, ta_dir: str, navidrome_dir: str, db_file: str, ta_api: TubeArchivistAPI | None = None,
+                 max_workers: int = 4):
         self.ta_dir = Path(ta_dir)
         self.navidrome_dir = Path(navidrome_dir)
         self.db_file = Path(db_file)
@@ -135,97 +272,109 @@ class MusicDownloader:
 
         mp3_downloaded_count = self._get_mp3_downloaded_count()
 
+        # yt-dlpのダウンロードはネットワーク/ディスク待ちが主なので、スレッドで並列実行する
+        self._pool = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix='download')
+        # 並列実行中の処理が同じ動画・同じ出力ファイルを扱わないように、処理中のキーを追跡する
+        # キーは ('video', 動画ID) または ('mp3', 出力MP3ファイルのパス)
+        self._in_flight: set[tuple[str, str]] = set()
+        self._in_flight_cond = threading.Condition()
+
         logger.info(f"入力ディレクトリ: {self.ta_dir}")
         logger.info(f"出力ディレクトリ: {self.navidrome_dir}")
         logger.info(f"MP3ダウンロード済みファイル数: {mp3_downloaded_count}")
+        logger.info(f"同時ダウンロード数: {max_workers}")
         if self.ta_api:
             logger.info("TubeArchivist APIが有効です")
+            # 最初のイベントを待たずにMUSICプレイリストを取得し、以降も定期的に更新しておく
+            self.ta_api.start_refresh()
         else:
             logger.warning("TubeArchivist APIが無効です。MUSICプレイリスト判定はスキップされます")
 
     def _init_database(self):
-        """データベースを初期化する"""
+        """データベースを初期化する（接続はプロセス全体で1つを使い回す）"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            # MP3ダウンロード済み動画のハッシュを保存するテーブルを作成
-            cursor.execute('''
-                CREATE TABLE IF NOT EXISTS mp3_downloaded_videos (
-                    file_hash TEXT PRIMARY KEY,
+            self._conn = sqlite3.connect(
+                str(self.db_file), check_same_thread=False, isolation_level=None)
+            self._db_lock = threading.Lock()
+            # WALモードにして書き込み時のfsyncを削減
+            self._conn.execute('PRAGMA journal_mode=WAL')
+            self._conn.execute('PRAGMA synchronous=NORMAL')
+            # MP3ダウンロード済み動画のYouTube動画IDを保存するテーブルを作成
+            # （旧バージョンはMP4ファイルのハッシュを mp3_downloaded_videos に保存していたが、
+            #   ハッシュ計算にファイル全体の読み込みが必要なため動画IDをキーに変更）
+            self._conn.execute('''
+                CREATE TABLE IF NOT EXISTS mp3_downloaded_youtube_ids (
+                    youtube_id TEXT PRIMARY KEY,
                     mp3_downloaded_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
                 )
             ''')
-            # インデックスを作成して検索を高速化
-            cursor.execute('''
-                CREATE INDEX IF NOT EXISTS idx_file_hash 
-                ON mp3_downloaded_videos(file_hash)
-            ''')
-            conn.commit()
-            conn.close()
+            # 旧バージョンのハッシュ記録テーブルは動画IDに対応付けられないため削除する
+            # （主キーと重複していたインデックス idx_file_hash もテーブルと一緒に削除される）
+            legacy_count = self._get_legacy_mp3_downloaded_count()
+            if legacy_count is not None:
+                logger.warning(
+                    f"旧形式（ファイルハッシュ）のMP3ダウンロード済み記録 {legacy_count} 件は動画IDに変換できないため削除します"
+                    "（既存のMP3ファイルは削除されません）")
+                self._conn.execute('DROP TABLE mp3_downloaded_videos')
             logger.info(f"データベースを初期化しました: {self.db_file}")
         except Exception as e:
             logger.error(f"データベースの初期化に失敗: {e}")
             raise
 
+    def _get_legacy_mp3_downloaded_count(self) -> int | None:
+        """旧形式のテーブル mp3_downloaded_videos の件数を取得（テーブルがなければNone）"""
+        exists = self._conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'mp3_downloaded_videos'"
+        ).fetchone()
+        if not exists:
+            return None
+        return self._conn.execute('SELECT COUNT(*) FROM mp3_downloaded_videos').fetchone()[0]
+
+    def close(self):
+        """未開始の処理を取り消し、実行中の処理の完了を待ってからデータベース接続を閉じる"""
+        if self.ta_api:
+            self.ta_api.stop_refresh()
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._db_lock:
+            self._conn.close()
+
     def _get_mp3_downloaded_count(self) -> int:
         """MP3ダウンロード済みファイル数を取得"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            cursor.execute('SELECT COUNT(*) FROM mp3_downloaded_videos')
-            count = cursor.fetchone()[0]
-            conn.close()
-            return count
+            with self._db_lock:
+                return self._conn.execute(
+                    'SELECT COUNT(*) FROM mp3_downloaded_youtube_ids').fetchone()[0]
         except Exception as e:
             logger.error(f"MP3ダウンロード済みファイル数の取得に失敗: {e}")
             return 0
 
-    def is_mp3_downloaded(self, file_hash: str) -> bool:
-        """ファイルがMP3ダウンロード済みかどうかを確認"""
+    def is_mp3_downloaded(self, youtube_id: str) -> bool:
+        """動画がMP3ダウンロード済みかどうかを確認"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            cursor.execute(
-                'SELECT 1 FROM mp3_downloaded_videos WHERE file_hash = ?', (file_hash,))
-            result = cursor.fetchone() is not None
-            conn.close()
-            return result
+            with self._db_lock:
+                return self._conn.execute(
+                    'SELECT 1 FROM mp3_downloaded_youtube_ids WHERE youtube_id = ?',
+                    (youtube_id,)).fetchone() is not None
         except Exception as e:
             logger.error(f"MP3ダウンロード済み確認に失敗: {e}")
             return False
 
-    def mark_as_mp3_downloaded(self, file_hash: str):
-        """ファイルをMP3ダウンロード済みとしてマーク"""
+    def mark_as_mp3_downloaded(self, youtube_id: str):
+        """動画をMP3ダウンロード済みとしてマーク"""
         try:
-            conn = sqlite3.connect(str(self.db_file))
-            cursor = conn.cursor()
-            cursor.execute(
-                # 既に同じ file_hash が存在する場合、エラーにせず無視する。(重複挿入を防ぐため)
-                'INSERT OR IGNORE INTO mp3_downloaded_videos (file_hash) VALUES (?)',
-                (file_hash,)
-            )
-            conn.commit()
-            conn.close()
+            with self._db_lock:
+                self._conn.execute(
+                    # 既に同じ youtube_id が存在する場合、エラーにせず無視する。(重複挿入を防ぐため)
+                    'INSERT OR IGNORE INTO mp3_downloaded_youtube_ids (youtube_id) VALUES (?)',
+                    (youtube_id,)
+                )
         except Exception as e:
             logger.error(f"MP3ダウンロード済みマークの保存に失敗: {e}")
 
-    def _get_file_hash(self, file_path: Path) -> str:
-        """MP4ファイルのハッシュ値を計算"""
-        hash_md5 = hashlib.md5()
-        try:
-            with open(file_path, 'rb') as f:
-                for chunk in iter(lambda: f.read(4096), b''):
-                    hash_md5.update(chunk)
-            return hash_md5.hexdigest()
-        except Exception as e:
-            logger.error(f"ハッシュ計算に失敗 ({file_path}): {e}")
-            return ""
-
     def _is_video_file(self, file_path: Path) -> bool:
         """動画ファイルかどうかを判定"""
-        video_extensions = {'.mp4', '.mkv',
-                            '.webm', '.avi', '.mov', '.flv', '.m4v'}
-        return file_path.suffix.lower() in video_extensions
+        return file_path.suffix.lower() in _VIDEO_EXTS
 
     def _extract_video_id(self, video_path: Path) -> str | None:
         """ファイルパスから動画IDを抽出
@@ -246,8 +395,7 @@ class MusicDownloader:
     def _sanitize_filename(self, filename: str) -> str:
         """ファイル名をサニタイズ（ファイルシステムで使用できない文字を削除）"""
         # Windows/Linux/Macで使用できない文字を削除
-        invalid_chars = r'[<>:"/\\|?*\x00-\x1f]'
-        sanitized = re.sub(invalid_chars, '_', filename)
+        sanitized = filename.translate(_SANITIZE_TABLE)
         # 先頭・末尾の空白やドットを削除
         sanitized = sanitized.strip(' .')
         # 長すぎるファイル名を切り詰め（255文字制限）
@@ -269,8 +417,15 @@ class MusicDownloader:
             # フォールバック: 動画IDを使用
             output_template = str(self.navidrome_dir / f"{youtube_id}.%(ext)s")
 
-        # 既にMP3ファイルが存在する場合はスキップ
+        # 同じタイトルの別動画が同時にダウンロード中の場合は、完了を待ってから進める
+        # （同じファイル・.partファイルへの同時書き込みを防ぐ）
         expected_mp3_path = Path(output_template.replace('%(ext)s', 'mp3'))
+        with self._claim_output(expected_mp3_path):
+            return self._run_ytdlp(youtube_url, output_template, expected_mp3_path)
+
+    def _run_ytdlp(self, youtube_url: str, output_template: str, expected_mp3_path: Path) -> Path | None:
+        """yt-dlpを実行する（expected_mp3_pathを確保した状態で呼ぶ）"""
+        # 既にMP3ファイルが存在する場合はスキップ
         if expected_mp3_path.exists():
             logger.info(f"MP3ファイルが既に存在します: {expected_mp3_path}")
             return expected_mp3_path
@@ -282,6 +437,9 @@ class MusicDownloader:
         # --audio-format mp3: MP3形式で出力
         # --audio-quality 0: 最高音質（0=最高品質）
         # --embed-thumbnail: サムネイルを埋め込み
+        # --no-progress: 進捗表示を出力しない（capture_outputで溜め込む出力を減らす）
+        # --concurrent-fragments: HLS/DASHのフラグメントを並列ダウンロード
+        # --retries / --fragment-retries: 一時的なネットワークエラー時の再試行回数
         # --output: 出力ファイル名テンプレート
         cmd = [
             'yt-dlp',
@@ -289,6 +447,10 @@ class MusicDownloader:
             '--audio-format', 'mp3',       # MP3形式
             '--audio-quality', '0',        # 最高音質（0=最高品質）
             '--embed-thumbnail',           # サムネイルを埋め込み
+            '--no-progress',               # 進捗表示なし
+            '--concurrent-fragments', '4',  # フラグメントの並列ダウンロード数
+            '--retries', '10',             # ダウンロードの再試行回数
+            '--fragment-retries', '10',    # フラグメントの再試行回数
             '--output', output_template,   # 出力ファイル名
             youtube_url                    # YouTube URL
         ]
@@ -321,56 +483,104 @@ class MusicDownloader:
             logger.error(f"ダウンロード中にエラーが発生: {youtube_url}, {e}")
             return None
 
-    def process_video(self, video_path: Path) -> bool:
-        """動画を処理（MP3ダウンロード）する"""
-        if not video_path.exists():
-            logger.warning(f"ファイルが存在しません: {video_path}")
-            return False
+    def _try_claim(self, key: tuple[str, str]) -> bool:
+        """キーが処理中でなければ確保してTrueを返す"""
+        with self._in_flight_cond:
+            if key in self._in_flight:
+                return False
+            self._in_flight.add(key)
+            return True
+
+    def _release(self, key: tuple[str, str]):
+        """確保したキーを解放し、待機中のスレッドに通知する"""
+        with self._in_flight_cond:
+            self._in_flight.discard(key)
+            self._in_flight_cond.notify_all()
+
+    @contextmanager
+    def _claim_output(self, mp3_path: Path) -> Iterator[None]:
+        """出力MP3ファイルを確保する（他の処理が使用中なら解放されるまで待つ）"""
+        key = ('mp3', str(mp3_path))
+        with self._in_flight_cond:
+            while key in self._in_flight:
+                self._in_flight_cond.wait()
+            self._in_flight.add(key)
+        try:
+            yield
+        finally:
+            self._release(key)
+
+    def submit(self, video_path: Path) -> Future:
+        """動画の処理をスレッドプールに投入する"""
+        return self._pool.submit(self.process_video, video_path)
 
+    def process_video(self, video_path: Path) -> bool:
+        """動画を処理（MP3ダウンロード）する
+        ファイルI/Oを伴わない判定から順に行い、処理済みの動画では元ファイルに触れずに終了する
+        """
         if not self._is_video_file(video_path):
             logger.debug(f"動画ファイルではありません: {video_path}")
             return False
 
-        # ファイルのハッシュを計算して、既にMP3ダウンロード済みかチェック
-        file_hash = self._get_file_hash(video_path)
-        if not file_hash:
-            logger.warning(f"ハッシュ計算に失敗: {video_path}")
+        # ファイルパスから動画IDを抽出
+        video_id = self._extract_video_id(video_path)
+        if not video_id:
+            logger.warning(f"動画IDを抽出できませんでした: {video_path}")
             return False
 
-        if self.is_mp3_downloaded(file_hash):
+        # 同じ動画IDが別のパスから同時に処理されている場合はスキップ（そちらで記録される）
+        key = ('video', video_id)
+        if not self._try_claim(key):
+            logger.info(f"動画 {video_id} は処理中のため、スキップします: {video_path}")
+            return False
+        try:
+            return self._process_video_id(video_path, video_id)
+        finally:
+            self._release(key)
+
+    def _process_video_id(self, video_path: Path, video_id: str) -> bool:
+        """動画IDを確保した状態で、ダウンロード済み判定からMP3ダウンロードまでを行う"""
+        # 動画IDで既にMP3ダウンロード済みかチェック（動画ファイル自体は読み込まない）
+        if self.is_mp3_downloaded(video_id):
             logger.debug(f"既にMP3ダウンロード済み: {video_path}")
             return False
 
+        # 動画IDをファイル名にしたMP3（タイトル取得失敗時のフォールバック）が既にあれば記録してスキップ
+        fallback_mp3_path = self.navidrome_dir / f"{video_id}.mp3"
+        if fallback_mp3_path.exists():
+            logger.info(f"MP3ファイルが既に存在します: {fallback_mp3_path}")
+            self.mark_as_mp3_downloaded(video_id)
+            return False
+
+        if not video_path.exists():
+            logger.warning(f"ファイルが存在しません: {video_path}")
+            return False
+
         # TubeArchivist APIを使用する場合
-        video_id = None
         video_title = None
         if self.ta_api:
-            # ファイルパスから動画IDを抽出
-            video_id = self._extract_video_id(video_path)
-            if not video_id:
-                logger.warning(f"動画IDを抽出できませんでした: {video_path}")
-                return False
-
             # MUSICプレイリストに含まれるかチェック
             if not self.ta_api.is_in_music_playlist(video_id):
                 logger.info(f"動画 {video_id} はMUSICプレイリストに含まれていないため、スキップします")
                 return False
 
-            # 動画情報を取得してタイトルを取得
-            video_info = self.ta_api.get_ta_video_info(video_id)
-            if video_info:
-                video_title = video_info.get(
-                    'title') or video_info.get('video_title')
-                if not video_title:
-                    logger.warning(f"動画タイトルを取得できませんでした (video_id: {video_id})")
-            else:
-                logger.warning(f"動画情報を取得できませんでした (video_id: {video_id})")
+            # プレイリストのエントリにタイトルが含まれていればそれを使い、なければ動画情報を取得
+            video_title = self.ta_api.get_music_video_title(video_id)
+            if not video_title:
+                video_info = self.ta_api.get_ta_video_info(video_id)
+                if video_info:
+                    video_title = video_info.get(
+                        'title') or video_info.get('video_title')
+                    if not video_title:
+                        logger.warning(f"動画タイトルを取得できませんでした (video_id: {video_id})")
+                else:
+                    logger.warning(f"動画情報を取得できませんでした (video_id: {video_id})")
 
             # yt-dlpでMP3+サムネイルをダウンロード
             mp3_path = self._download_mp3_with_thumbnail(video_id, video_title)
             if mp3_path and mp3_path.exists():
                 # MP3ダウンロード済みとしてマーク
-                self.mark_as_mp3_downloaded(file_hash)
+                self.mark_as_mp3_downloaded(video_id)
                 logger.info(f"MP3ダウンロード完了: {video_path} -> {mp3_path}")
                 return True
             else:
@@ -384,39 +594,124 @@ class MusicDownloader:
 class VideoFileHandler(FileSystemEventHandler):
     """ファイルシステムイベントを処理するハンドラ"""
 
+    # ファイルサイズの変化を確認する間隔（秒）
+    STABLE_CHECK_INTERVAL = 1.0
+
     def __init__(self, downloader: MusicDownloader):
         self.downloader = downloader
-        self.processing = set()  # 処理中のファイルを追跡
+        # キュー投入済み・処理中のファイルを追跡（値は書き込み完了（close）の通知用イベント）
+        # キーはイベントのパス文字列（Pathよりハッシュ計算が軽い）
+        self.processing: dict[str, threading.Event] = {}
+        self._lock = threading.Lock()
+        # イベントはキューに積むだけにして、監視スレッドをブロックしないようにする
+        self._queue: queue.Queue[str | None] = queue.Queue()
+        self._stop_event = threading.Event()
+        self._worker_thread = threading.Thread(target=self._worker, daemon=True)
+        self._worker_thread.start()
+
+    def stop(self):
+        """ワーカースレッドを停止する（ダウンローダーを閉じる前に呼ぶ）"""
+        self._stop_event.set()
+        # 書き込み完了を待っているファイルの待機を打ち切る
+        with self._lock:
+            for closed_event in self.processing.values():
+                closed_event.set()
+        self._queue.put(None)
+        self._worker_thread.join()
 
     def on_created(self, event: FileSystemEvent):
         """ファイルが作成されたときの処理"""
         if event.is_directory:
             return
 
-        file_path = Path(event.src_path)
-        self._process_file(file_path)
+        self._enqueue(event.src_path, closed=False)
 
-    def _process_file(self, file_path: Path):
-        """ファイルを処理する（重複処理を防ぐ）"""
-        # 処理中のファイルはスキップ
-        if file_path in self.processing:
+    def on_closed(self, event: FileSystemEvent):
+        """書き込み中のファイルが閉じられたときの処理
+        inotify（IN_CLOSE_WRITE）で監視している場合のみ発生し、PollingObserverでは発生しない
+        書き込み完了が確定しているため、サイズの安定を待たずに処理する
+        """
+        if event.is_directory:
             return
 
-        # ファイルが完全に書き込まれるまで少し待つ
-        import time
-        time.sleep(2)
+        self._enqueue(event.src_path, closed=True)
 
-        # ファイルが存在し、サイズが0でないことを確認
-        if not file_path.exists() or file_path.stat().st_size == 0:
-            logger.debug(f"ファイルがまだ準備中または空です: {file_path}")
+    def _enqueue(self, src_path: str, closed: bool):
+        """動画ファイルをキューに入れる"""
+        # 動画ファイル以外（yt-dlpの.partや.json、サムネイル等）はPathも作らずに無視する
+        if os.path.splitext(src_path)[1].lower() not in _VIDEO_EXTS:
             return
 
-        # 処理中フラグを設定
-        self.processing.add(file_path)
+        # 同じファイルへの連続したイベントはまとめる（重複処理を防ぐ）
+        with self._lock:
+            closed_event = self.processing.get(src_path)
+            if closed_event is not None:
+                # 作成イベントで待機中のファイルが閉じられた場合は待機を打ち切る
+                if closed:
+                    closed_event.set()
+                return
+            closed_event = threading.Event()
+            if closed:
+                closed_event.set()
+            self.processing[src_path] = closed_event
+        self._queue.put(src_path)
+
+    def _worker(self):
+        """キューからファイルを取り出し、書き込み完了後にダウンローダーのスレッドプールへ渡す"""
+        while True:
+            src_path = self._queue.get()
+            if src_path is None:
+                self._queue.task_done()
+                return
+            try:
+                self._process_file(src_path)
+            except Exception as e:
+                logger.error(f"ファイル処理中にエラーが発生 ({src_path}): {e}")
+                self._finish(src_path)
+            finally:
+                self._queue.task_done()
+
+    def _finish(self, src_path: str, future: Future | None = None):
+        """処理中フラグを解除する"""
+        if future is not None and not future.cancelled():
+            error = future.exception()
+            if error:
+                logger.error(f"ファイル処理中にエラーが発生 ({src_path}): {error}")
+        with self._lock:
+            self.processing.pop(src_path, None)
+
+    def _wait_until_stable(self, file_path: Path, closed_event: threading.Event) -> bool:
+        """ファイルが閉じられるか、サイズが変化しなくなるまで待つ（書き込み完了の判定）"""
         try:
-            self.downloader.process_video(file_path)
-        finally:
-            self.processing.discard(file_path)
+            size = file_path.stat().st_size
+            while not closed_event.wait(self.STABLE_CHECK_INTERVAL):
+                current_size = file_path.stat().st_size
+                if current_size == size:
+                    return current_size > 0
+                size = current_size
+            return file_path.stat().st_size > 0
+        except FileNotFoundError:
+            return False
+
+    def _process_file(self, src_path: str):
+        """ファイルを処理する（処理完了まで処理中フラグを維持する）"""
+        with self._lock:
+            closed_event = self.processing[src_path]
+
+        # ファイルが完全に書き込まれるまで待ち、存在してサイズが0でないことを確認
+        file_path = Path(src_path)
+        if not self._wait_until_stable(file_path, closed_event):
+            logger.debug(f"ファイルがまだ準備中または空です: {file_path}")
+            self._finish(src_path)
+            return
+
+        # シャットダウン中は新しい処理を投入しない
+        if self._stop_event.is_set():
+            self._finish(src_path)
+            return
+
+        future = self.downloader.submit(file_path)
+        future.add_done_callback(lambda f: self._finish(src_path, f))
 
 
 def main():
@@ -427,6 +722,24 @@ def main():
     navidrome_dir = os.getenv('NAVIDROME_DIR', '/music')
     # MP3ダウンロード済みの動画ファイルを記録するデータベースファイルのパス
     db_file = os.getenv('DB_FILE', '/app/data/mp3_downloaded.db')
+    # 同時に実行するMP3ダウンロード数
+    max_workers = int(os.getenv('MAX_CONCURRENT_DOWNLOADS', '4'))
+    # MUSICプレイリストをバックグラウンドで取得し直す間隔（秒）
+    playlist_refresh_interval_env = os.getenv('PLAYLIST_REFRESH_INTERVAL', '300')
+    try:
+        playlist_refresh_interval = float(playlist_refresh_interval_env)
+    except ValueError:
+        playlist_refresh_interval = 0
+    if not 0 < playlist_refresh_interval < float('inf'):
+        logger.warning(
+            f"PLAYLIST_REFRESH_INTERVALの値が不正です: {playlist_refresh_interval_env}（正の秒数を指定してください）。300秒で動作します")
+        playlist_refresh_interval = 300
+    # ファイル監視方式（polling: ポーリング、native: inotify等のOSの通知機能）
+    observer_type = os.getenv('OBSERVER_TYPE', 'polling')
+    if observer_type not in ('polling', 'native'):
+        logger.warning(
+            f"OBSERVER_TYPEの値が不正です: {observer_type}（polling または native を指定してください）。pollingで動作します")
+        observer_type = 'polling'
 
     # TubeArchivist API設定
     ta_api_url = os.getenv('TA_API_URL')
@@ -440,7 +753,8 @@ def main():
     api = None
     if ta_api_url and ta_token:
         try:
-            api = TubeArchivistAPI(ta_api_url, ta_token)
+            api = TubeArchivistAPI(
+                ta_api_url, ta_token, refresh_interval=playlist_refresh_interval)
             logger.info(f"TubeArchivist APIに接続: {ta_api_url}")
         except Exception as e:
             logger.error(f"TubeArchivist APIの初期化に失敗: {e}")
@@ -450,26 +764,35 @@ def main():
         logger.warning("MUSICプレイリスト判定はスキップされます")
 
     # ダウンローダーを初期化
-    downloader = MusicDownloader(ta_dir, navidrome_dir, db_file, api)
+    downloader = MusicDownloader(
+        ta_dir, navidrome_dir, db_file, api, max_workers=max_workers)
 
     # ファイルシステム監視を開始
     event_handler = VideoFileHandler(downloader)
-    observer = PollingObserver(timeout=10)  # NFS上でも確実に検知するためポーリング方式を使用
+    if observer_type == 'native':
+        # ローカルディスク向け。書き込み完了（IN_CLOSE_WRITE）をon_closedで直接検知できる
+        observer = Observer()
+    else:
+        observer = PollingObserver(timeout=10)  # NFS上でも確実に検知するためポーリング方式を使用
+    logger.info(f"ファイル監視方式: {observer_type}")
     # TubeArchivistの動画ディレクトリを監視ルートに設定
+    # チャンネルごとのサブディレクトリは新しいチャンネルの動画取得時に作られ、事前に個別登録できないため再帰的に監視する
     observer.schedule(event_handler, str(downloader.ta_dir), recursive=True)
     observer.start()
 
     logger.info("ファイル監視を開始しました")
 
-    try:
-        while True:
-            import time
-            time.sleep(1)
-    except KeyboardInterrupt:
-        logger.info("シャットダウンを開始します...")
-        observer.stop()
+    # SIGTERM/SIGINTを受け取るまでメインスレッドを待機させる（定期的な起床なし）
+    stop_event = threading.Event()
+    signal.signal(signal.SIGTERM, lambda *_: stop_event.set())
+    signal.signal(signal.SIGINT, lambda *_: stop_event.set())
+    stop_event.wait()
 
+    logger.info("シャットダウンを開始します...")
+    observer.stop()
     observer.join()
+    event_handler.stop()
+    downloader.close()
     logger.info("アプリケーションを終了します")
 
 